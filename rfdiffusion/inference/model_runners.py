@@ -420,7 +420,7 @@ class Sampler:
                         you need to make sure there's a ligand in the input_pdb file!"
                 het_names = np.array([i['name'].strip() for i in self.target_feats['info_het']])
                 xyz_het = self.target_feats['xyz_het'][het_names == self._conf.potentials.substrate]
-                xyz_het = torch.from_numpy(xyz_het)
+                xyz_het = torch.from_numpy(xyz_het).float()
                 assert xyz_het.shape[0] > 0, f'expected >0 heteroatoms from ligand with name {self._conf.potentials.substrate}'
                 xyz_motif_prealign = xyz_motif_prealign[0,0][self.diffusion_mask.squeeze()]
                 motif_prealign_com = xyz_motif_prealign[:,1].mean(dim=0)
@@ -175,7 +175,9 @@ class PotentialManager:
             This is the money call. Take the current sequence and structure information and get the sum of all of the potentials that are being used
         '''
 
-        potential_list = [potential.compute(xyz, **kwargs) for potential in self.potentials_to_apply]
+        # Ca coordinates and distance maps shared between the potentials, only valid for this xyz
+        cache = {}
+        potential_list = [potential.compute(xyz, cache=cache, **kwargs) for potential in self.potentials_to_apply]
         potential_stack = torch.stack(potential_list, dim=0)
         log.info(f"potentail_stack={potential_stack.detach().cpu().numpy()}")
         return torch.sum(potential_stack, dim=0)
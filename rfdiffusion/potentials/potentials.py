@@ -2,12 +2,91 @@ import torch
 import numpy as np
 from rfdiffusion.util import generate_Cbeta
 import logging
-import pandas as pd
+from types import MappingProxyType
 from rfdiffusion.inference.utils import rigid_from_3_points
 
 log = logging.getLogger(__name__)
 
 
+def pairwise_dist(x1, x2):
+    """
+    Euclidean distances between two sets of points using ||x||^2 + ||y||^2 - 2x.y
+
+    Faster than torch.cdist for the small (L,3) inputs used by the potentials,
+    with a much smaller backward buffer.
+
+    Args:
+        x1 (torch.tensor, size: [N,3])
+        x2 (torch.tensor, size: [M,3])
+
+    Returns:
+        dgram (torch.tensor, size: [N,M])
+    """
+    x1_norm = x1.pow(2).sum(dim=-1, keepdim=True)  # [N,1]
+    x2_norm = x2.pow(2).sum(dim=-1, keepdim=True)  # [M,1]
+    d2 = torch.addmm(x2_norm.transpose(-2, -1), x1, x2.transpose(-2, -1), alpha=-2)
+    # all in place, the only [N,M] allocation is the addmm output
+    return d2.add_(x1_norm).clamp_min_(1e-30).sqrt_()
+
+
+def get_Ca(xyz, cache=None):
+    """
+    Ca coordinates of xyz, shared through cache between the potentials evaluated on the same xyz
+
+    Args:
+        xyz (torch.tensor, size: [L,27,3]): The current coordinates of the sample
+        cache (dict, optional): Per xyz cache passed to Potential.compute by the PotentialManager
+
+    Returns:
+        Ca (torch.tensor, size: [L,3])
+    """
+    if cache is None:
+        return xyz[:, 1]
+    if "Ca" not in cache:
+        cache["Ca"] = xyz[:, 1].contiguous()
+    return cache["Ca"]
+
+
+def get_Ca_dgram(xyz, rows=slice(None), cols=slice(None), cache=None):
+    """
+    Ca-Ca distances between the residues in rows and cols, shared through cache between the
+    potentials evaluated on the same xyz
+
+    Args:
+        xyz (torch.tensor, size: [L,27,3]): The current coordinates of the sample
+        rows, cols (slice, optional): Residues to compute the distances between, defaults to all residues
+        cache (dict, optional): Per xyz cache passed to Potential.compute by the PotentialManager
+
+    Returns:
+        dgram (torch.tensor, size: [len(rows),len(cols)])
+    """
+    Ca = get_Ca(xyz, cache)
+    if cache is None:
+        return pairwise_dist(Ca[rows], Ca[cols])
+    L = Ca.shape[0]
+    key = ("Ca_dgram",) + rows.indices(L) + cols.indices(L)
+    if key not in cache:
+        cache[key] = pairwise_dist(Ca[rows], Ca[cols])
+    return cache[key]
+
+
+@torch.jit.script
+def fused_contact(dgram: torch.Tensor, d_0: float, r_0: float) -> torch.Tensor:
+    """
+    Differentiable contact count (1 - x^6) / (1 - x^12) with x = (dgram - d_0) / r_0
+
+    Scripted so the elementwise ops fuse into a single kernel instead of
+    materialising one [L,L] intermediate per op.
+    """
+    # x = dgram / r_0 - d_0 / r_0, with the shift skipped for d_0 == 0
+    x = dgram * (1.0 / r_0)
+    if d_0 != 0.0:
+        x = x - d_0 / r_0
+    x3 = x * x * x
+    x6 = x3 * x3
+    return (1 - x6) / (1 - x6 * x6)
+
+
 class Potential:
     """
     Interface class that defines the functions a potential must implement
@@ -21,6 +100,9 @@ class Potential:
         Args:
             xyz (torch.tensor, size: [L,27,3]: The current coordinates of the sample
 
+            cache (dict, optional): Shared between all potentials evaluated on this xyz,
+                                    see get_Ca and get_Ca_dgram
+
         Returns:
             potential (torch.tensor, size: [1]): A potential whose value will be MAXIMIZED
                                                  by taking a step along it's gradient
@@ -28,6 +110,17 @@ class Potential:
         raise NotImplementedError("Potential compute function was not overwritten")
 
 
+def get_rad_of_gyration(Ca, min_dist=0):
+    """
+    Radius of gyration of a set of coordinates, sqrt(mean(|Ca - centroid|^2))
+
+    Distances to the centroid below min_dist are clamped to min_dist, on the
+    squared distances so no sqrt is needed per residue.
+    """
+    sq_dist = (Ca - Ca.mean(dim=0, keepdim=True)).pow(2).sum(dim=-1)  # [L]
+    return sq_dist.clamp_min(min_dist**2).mean().sqrt()  # [1]
+
+
 class monomer_ROG(Potential):
     """
     Radius of Gyration potential for encouraging monomer compactness
@@ -40,21 +133,9 @@ class monomer_ROG(Potential):
         self.min_dist = min_dist
 
     def compute(self, xyz, **kwargs):
-        Ca = xyz[:, 1]  # [L,3]
-
-        centroid = torch.mean(Ca, dim=0, keepdim=True)  # [1,3]
-
-        dgram = torch.cdist(
-            Ca[None, ...].contiguous(), centroid[None, ...].contiguous(), p=2
-        )  # [1,L,1,3]
-
-        dgram = torch.maximum(
-            self.min_dist * torch.ones_like(dgram.squeeze(0)), dgram.squeeze(0)
-        )  # [L,1,3]
+        Ca = get_Ca(xyz, kwargs.get("cache"))  # [L,3]
 
-        rad_of_gyration = torch.sqrt(
-            torch.sum(torch.square(dgram)) / Ca.shape[0]
-        )  # [1]
+        rad_of_gyration = get_rad_of_gyration(Ca, self.min_dist)  # [1]
 
         return -1 * self.weight * rad_of_gyration
 
@@ -73,22 +154,9 @@ class binder_ROG(Potential):
 
     def compute(self, xyz, **kwargs):
         # Only look at binder residues
-        Ca = xyz[: self.binderlen, 1]  # [Lb,3]
+        Ca = get_Ca(xyz, kwargs.get("cache"))[: self.binderlen]  # [Lb,3]
 
-        centroid = torch.mean(Ca, dim=0, keepdim=True)  # [1,3]
-
-        # cdist needs a batch dimension - NRB
-        dgram = torch.cdist(
-            Ca[None, ...].contiguous(), centroid[None, ...].contiguous(), p=2
-        )  # [1,Lb,1,3]
-
-        dgram = torch.maximum(
-            self.min_dist * torch.ones_like(dgram.squeeze(0)), dgram.squeeze(0)
-        )  # [Lb,1,3]
-
-        rad_of_gyration = torch.sqrt(
-            torch.sum(torch.square(dgram)) / Ca.shape[0]
-        )  # [1]
+        rad_of_gyration = get_rad_of_gyration(Ca, self.min_dist)  # [1]
 
         return -1 * self.weight * rad_of_gyration
 
@@ -106,38 +174,19 @@ class dimer_ROG(Potential):
         self.weight = weight
 
     def compute(self, xyz, **kwargs):
+        Ca = get_Ca(xyz, kwargs.get("cache"))  # [L,3]
+
         # Only look at monomer 1 residues
-        Ca_m1 = xyz[: self.binderlen, 1]  # [Lb,3]
+        Ca_m1 = Ca[: self.binderlen]  # [Lb,3]
 
         # Only look at monomer 2 residues
-        Ca_m2 = xyz[self.binderlen :, 1]  # [Lb,3]
-
-        centroid_m1 = torch.mean(Ca_m1, dim=0, keepdim=True)  # [1,3]
-        centroid_m2 = torch.mean(Ca_m1, dim=0, keepdim=True)  # [1,3]
+        Ca_m2 = Ca[self.binderlen :]  # [Lt,3]
 
-        # cdist needs a batch dimension - NRB
         # This calculates RoG for Monomer 1
-        dgram_m1 = torch.cdist(
-            Ca_m1[None, ...].contiguous(), centroid_m1[None, ...].contiguous(), p=2
-        )  # [1,Lb,1,3]
-        dgram_m1 = torch.maximum(
-            self.min_dist * torch.ones_like(dgram_m1.squeeze(0)), dgram_m1.squeeze(0)
-        )  # [Lb,1,3]
-        rad_of_gyration_m1 = torch.sqrt(
-            torch.sum(torch.square(dgram_m1)) / Ca_m1.shape[0]
-        )  # [1]
-
-        # cdist needs a batch dimension - NRB
+        rad_of_gyration_m1 = get_rad_of_gyration(Ca_m1, self.min_dist)  # [1]
+
         # This calculates RoG for Monomer 2
-        dgram_m2 = torch.cdist(
-            Ca_m2[None, ...].contiguous(), centroid_m2[None, ...].contiguous(), p=2
-        )  # [1,Lb,1,3]
-        dgram_m2 = torch.maximum(
-            self.min_dist * torch.ones_like(dgram_m2.squeeze(0)), dgram_m2.squeeze(0)
-        )  # [Lb,1,3]
-        rad_of_gyration_m2 = torch.sqrt(
-            torch.sum(torch.square(dgram_m2)) / Ca_m2.shape[0]
-        )  # [1]
+        rad_of_gyration_m2 = get_rad_of_gyration(Ca_m2, self.min_dist)  # [1]
 
         # Potential value is the average of both radii of gyration (is avg. the best way to do this?)
         return -1 * self.weight * (rad_of_gyration_m1 + rad_of_gyration_m2) / 2
@@ -159,20 +208,15 @@ class binder_ncontacts(Potential):
 
     def compute(self, xyz, **kwargs):
         # Only look at binder Ca residues
-        Ca = xyz[: self.binderlen, 1]  # [Lb,3]
-
-        # cdist needs a batch dimension - NRB
-        dgram = torch.cdist(
-            Ca[None, ...].contiguous(), Ca[None, ...].contiguous(), p=2
-        )  # [1,Lb,Lb]
-        divide_by_r_0 = (dgram - self.d_0) / self.r_0
-        numerator = torch.pow(divide_by_r_0, 6)
-        denominator = torch.pow(divide_by_r_0, 12)
-        binder_ncontacts = (1 - numerator) / (1 - denominator)
-
-        print("BINDER CONTACTS:", binder_ncontacts.sum())
+        binder = slice(None, self.binderlen)
+        dgram = get_Ca_dgram(xyz, binder, binder, cache=kwargs.get("cache"))  # [Lb,Lb]
+        binder_ncontacts = fused_contact(dgram, float(self.d_0), float(self.r_0))
+        binder_ncontacts = binder_ncontacts.sum()
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f"BINDER CONTACTS: {binder_ncontacts:.3g}")
         # Potential value is the average of both radii of gyration (is avg. the best way to do this?)
-        return self.weight * binder_ncontacts.sum()
+        return self.weight * binder_ncontacts
 
 
 class interface_ncontacts(Potential):
@@ -192,24 +236,16 @@ class interface_ncontacts(Potential):
         self.d_0 = d_0
 
     def compute(self, xyz, **kwargs):
-        # Extract binder Ca residues
-        Ca_b = xyz[: self.binderlen, 1]  # [Lb,3]
-
-        # Extract target Ca residues
-        Ca_t = xyz[self.binderlen :, 1]  # [Lt,3]
-
-        # cdist needs a batch dimension - NRB
-        dgram = torch.cdist(
-            Ca_b[None, ...].contiguous(), Ca_t[None, ...].contiguous(), p=2
-        )  # [1,Lb,Lt]
-        divide_by_r_0 = (dgram - self.d_0) / self.r_0
-        numerator = torch.pow(divide_by_r_0, 6)
-        denominator = torch.pow(divide_by_r_0, 12)
-        interface_ncontacts = (1 - numerator) / (1 - denominator)
+        # Between binder and target Ca residues
+        binder = slice(None, self.binderlen)
+        target = slice(self.binderlen, None)
+        dgram = get_Ca_dgram(xyz, binder, target, cache=kwargs.get("cache"))  # [Lb,Lt]
+        interface_ncontacts = fused_contact(dgram, float(self.d_0), float(self.r_0))
         # Potential is the sum of values in the tensor
         interface_ncontacts = interface_ncontacts.sum()
 
-        print("INTERFACE CONTACTS:", interface_ncontacts.sum())
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f"INTERFACE CONTACTS: {interface_ncontacts:.3g}")
 
         return self.weight * interface_ncontacts
 
@@ -231,22 +267,32 @@ class monomer_contacts(Potential):
         self.eps = eps
 
     def compute(self, xyz, **kwargs):
-        Ca = xyz[:, 1]  # [L,3]
-
-        # cdist needs a batch dimension - NRB
-        dgram = torch.cdist(
-            Ca[None, ...].contiguous(), Ca[None, ...].contiguous(), p=2
-        )  # [1,Lb,Lb]
-        divide_by_r_0 = (dgram - self.d_0) / self.r_0
-        numerator = torch.pow(divide_by_r_0, 6)
-        denominator = torch.pow(divide_by_r_0, 12)
-
-        ncontacts = (1 - numerator) / ((1 - denominator))
+        dgram = get_Ca_dgram(xyz, cache=kwargs.get("cache"))  # [L,L]
+        ncontacts = fused_contact(dgram, float(self.d_0), float(self.r_0))
 
         # Potential value is the average of both radii of gyration (is avg. the best way to do this?)
         return self.weight * ncontacts.sum()
 
 
+def check_contact_matrix(contact_matrix):
+    """
+    Checks that the contact matrix is square, symmetric and only contains 0, 1, or -1 entries
+
+    Returns:
+        contact_matrix (torch.tensor, size: [Nchains,Nchains]): the contact matrix as a float tensor
+    """
+    contact_matrix = torch.as_tensor(contact_matrix, dtype=torch.float32)
+    # check contact matrix only contains valid entries
+    assert (
+        (contact_matrix == -1) | (contact_matrix == 0) | (contact_matrix == 1)
+    ).all(), "Contact matrix must contain only 0, 1, or -1 in entries"
+    # assert the matrix is square and symmetric
+    assert contact_matrix.ndim == 2
+    assert contact_matrix.shape[0] == contact_matrix.shape[1]
+    assert torch.equal(contact_matrix, contact_matrix.T)
+    return contact_matrix
+
+
 class olig_contacts(Potential):
     """
     Applies PV's num contacts potential within/between chains in symmetric oligomers
@@ -268,69 +314,79 @@ class olig_contacts(Potential):
 
             weight (int/float, optional): Scaling/weighting factor
         """
-        self.contact_matrix = contact_matrix
+        self.contact_matrix = check_contact_matrix(contact_matrix)
         self.weight_intra = weight_intra
         self.weight_inter = weight_inter
         self.r_0 = r_0
         self.d_0 = d_0
         self.verbose = verbose
 
-        # check contact matrix only contains valid entries
-        assert all(
-            [i in [-1, 0, 1] for i in contact_matrix.flatten()]
-        ), "Contact matrix must contain only 0, 1, or -1 in entries"
-        # assert the matrix is square and symmetric
-        shape = contact_matrix.shape
-        assert len(shape) == 2
-        assert shape[0] == shape[1]
-        for i in range(shape[0]):
-            for j in range(shape[1]):
-                assert contact_matrix[i, j] == contact_matrix[j, i]
-        self.nchain = shape[0]
-
-    def _get_idx(self, i, L):
+        self.nchain = self.contact_matrix.shape[0]
+
+        # chain blocks (i,j), i<=j, with a non-zero entry and their weight. Intra blocks are halved
+        # as every residue pair within a chain is counted twice
+        cm = self.contact_matrix.tolist()
+        self._blocks = [
+            (i, j, cm[i][j] / 2 if i == j else cm[i][j])
+            for i in range(self.nchain)
+            for j in range(i, self.nchain)
+            if cm[i][j] != 0
+        ]
+        # with most entries set, a single pass over the full [L,L] map is cheaper than per block passes
+        self._dense = (self.contact_matrix != 0).float().mean().item() > 0.5
+
+        # [L,L] intra/inter chain masks, built lazily in _get_masks and keyed by L
+        self._mask_cache = {}
+
+    def _get_masks(self, L, device):
         """
-        Returns the zero-indexed indices of the residues in chain i
+        Returns the residue-level intra and inter chain masks of shape [L,L]
+
+        Each block (i,j) holds contact_matrix[i,j] / 2, since every chain pair
+        appears twice in the full distance matrix.
         """
-        assert L % self.nchain == 0
-        Lchain = L // self.nchain
-        return i * Lchain + torch.arange(Lchain)
+        if L not in self._mask_cache:
+            assert L % self.nchain == 0
+            Lchain = L // self.nchain
+            cm = self.contact_matrix / 2
+            is_intra = torch.eye(self.nchain, dtype=torch.bool)
+            block = torch.ones((Lchain, Lchain))
+            intra_mask = torch.kron(cm * is_intra, block)
+            inter_mask = torch.kron(cm * ~is_intra, block)
+            self._mask_cache[L] = (intra_mask.to(device), inter_mask.to(device))
+        return self._mask_cache[L]
 
     def compute(self, xyz, **kwargs):
         """
-        Iterate through the contact matrix, compute contact potentials between chains that need it,
-        and negate contacts for any
+        Compute contact potentials between the chain pairs with a non-zero entry in the contact
+        matrix and weight each by that entry. Mostly non-zero matrices are evaluated in one pass
+        over all residues
         """
         L = xyz.shape[0]
+        cache = kwargs.get("cache")
+
+        if self._dense:
+            intra_mask, inter_mask = self._get_masks(L, xyz.device)
 
-        intra_contacts, inter_contacts = 0, 0
-        start = 0
-        for i in range(self.nchain):
-            for j in range(self.nchain):
-                # only compute for upper triangle, disregard zeros in contact matrix
-                if (i <= j) and (self.contact_matrix[i, j] != 0):
-                    # get the indices for these two chains
-                    idx_i = self._get_idx(i, L)
-                    idx_j = self._get_idx(j, L)
-
-                    Ca_i = xyz[idx_i, 1]  # slice out crds for this chain
-                    Ca_j = xyz[idx_j, 1]  # slice out crds for that chain
-                    dgram = torch.cdist(
-                        Ca_i[None, ...].contiguous(), Ca_j[None, ...].contiguous(), p=2
-                    )  # [1,Lb,Lb]
-
-                    divide_by_r_0 = (dgram - self.d_0) / self.r_0
-                    numerator = torch.pow(divide_by_r_0, 6)
-                    denominator = torch.pow(divide_by_r_0, 12)
-                    ncontacts = (1 - numerator) / (1 - denominator)
-
-                    if i == j:
-                        # weight, don't double count intra
-                        intra_contacts += (
-                            ncontacts.sum() * self.contact_matrix[i, j] / 2
-                        )
-                    else:
-                        inter_contacts += ncontacts.sum() * self.contact_matrix[i, j]
+            dgram = get_Ca_dgram(xyz, cache=cache)  # [L,L]
+            ncontacts = fused_contact(dgram, float(self.d_0), float(self.r_0))
+
+            intra_contacts = (ncontacts * intra_mask).sum()
+            inter_contacts = (ncontacts * inter_mask).sum()
+        else:
+            assert L % self.nchain == 0
+            Lchain = L // self.nchain
+            chains = [slice(i * Lchain, (i + 1) * Lchain) for i in range(self.nchain)]
+
+            # zero that stays in the autograd graph, even if no block is evaluated
+            intra_contacts = inter_contacts = get_Ca(xyz, cache).sum() * 0
+            for i, j, w in self._blocks:
+                dgram = get_Ca_dgram(xyz, chains[i], chains[j], cache=cache)
+                ncontacts = fused_contact(dgram, float(self.d_0), float(self.r_0)).sum()
+                if i == j:
+                    intra_contacts = intra_contacts + w * ncontacts
+                else:
+                    inter_contacts = inter_contacts + w * ncontacts
 
         all_contacts = (
             self.weight_intra * intra_contacts + self.weight_inter * inter_contacts
@@ -345,19 +401,53 @@ class olig_contacts(Potential):
         return all_contacts
 
 
-def get_damped_lj(r_min, r_lin, p1=6, p2=12):
-    y_at_r_lin = lj(r_lin, r_min, p1, p2)
-    ydot_at_r_lin = lj_grad(r_lin, r_min, p1, p2)
+@torch.jit.script
+def _lj_6_12(dgram: torch.Tensor, r_min: float) -> torch.Tensor:
+    """
+    lj for the default exponents p1=6, p2=12, with the powers unrolled into multiplies
+    """
+    s = (r_min * 2 ** (-1 / 6)) * torch.reciprocal(dgram)
+    s2 = s * s
+    s6 = s2 * s2 * s2
+    return 4 * (s6 * s6 - s6)
+
 
+def get_damped_lj(r_min, r_lin, p1=6, p2=12):
     def inner(dgram):
-        return (dgram < r_lin) * (ydot_at_r_lin * (dgram - r_lin) + y_at_r_lin) + (
-            dgram >= r_lin
-        ) * lj(dgram, r_min, p1, p2)
+        return damped_lj(dgram, float(r_min), float(r_lin), int(p1), int(p2))
 
     return inner
 
 
+@torch.jit.script
+def damped_lj(
+    dgram: torch.Tensor, r_min: float, r_lin: float, p1: int = 6, p2: int = 12
+) -> torch.Tensor:
+    """
+    Lennard-Jones potential (see lj), continued linearly below r_lin with the
+    value and slope (see lj_grad) it has at r_lin
+    """
+    sigma = r_min / 2 ** (1 / p1)
+    sigma_p1 = sigma**p1
+    sigma_p2 = sigma**p2
+    y_at_r_lin = 4 * (sigma_p2 / r_lin**p2 - sigma_p1 / r_lin**p1)
+    ydot_at_r_lin = -p2 * r_min**p1 * (r_min**p1 - r_lin**p1) / r_lin ** (p2 + 1)
+    linear = ydot_at_r_lin * (dgram - r_lin) + y_at_r_lin
+
+    # clamped so that the branch which is not taken stays finite in the backward pass
+    dgram_clamped = torch.clamp(dgram, min=r_lin)
+    if p1 == 6 and p2 == 12:
+        lj_val = _lj_6_12(dgram_clamped, r_min)
+    else:
+        inv_dgram = torch.reciprocal(dgram_clamped)
+        lj_val = 4 * (sigma_p2 * inv_dgram**p2 - sigma_p1 * inv_dgram**p1)
+
+    return torch.where(dgram < r_lin, linear, lj_val)
+
+
 def lj(dgram, r_min, p1=6, p2=12):
+    if p1 == 6 and p2 == 12 and isinstance(dgram, torch.Tensor):
+        return _lj_6_12(dgram, float(r_min))
     return 4 * (
         (r_min / (2 ** (1 / p1) * dgram)) ** p2
         - (r_min / (2 ** (1 / p1) * dgram)) ** p1
@@ -369,21 +459,16 @@ def lj_grad(dgram, r_min, p1=6, p2=12):
 
 
 def mask_expand(mask, n=1):
-    mask_out = mask.clone()
     assert mask.ndim == 1
-    for i in torch.where(mask)[0]:
-        for j in range(i - n, i + n + 1):
-            if j >= 0 and j < len(mask):
-                mask_out[j] = True
-    return mask_out
+    # 1D dilation: a position is set if any position within n of it is set
+    mask_out = torch.nn.functional.max_pool1d(
+        mask.float()[None, None], kernel_size=2 * n + 1, stride=1, padding=n
+    )
+    return mask_out[0, 0].bool()
 
 
 def contact_energy(dgram, d_0, r_0):
-    divide_by_r_0 = (dgram - d_0) / r_0
-    numerator = torch.pow(divide_by_r_0, 6)
-    denominator = torch.pow(divide_by_r_0, 12)
-
-    ncontacts = (1 - numerator) / ((1 - denominator)).float()
+    ncontacts = fused_contact(dgram, float(d_0), float(r_0)).float()
     return -ncontacts
 
 
@@ -437,16 +522,6 @@ class substrate_contacts(Potential):
         # This operates on self.xyz_motif, which is assigned to this class in the model runner (for horrible plumbing reasons)
         self._grab_motif_residues(self.xyz_motif)
 
-        # for checking affine transformation is corect
-        first_distance = torch.sqrt(
-            torch.sqrt(
-                torch.sum(
-                    torch.square(self.motif_substrate_atoms[0] - self.motif_frame[0]),
-                    dim=-1,
-                )
-            )
-        )
-
         # grab the coordinates of the corresponding atoms in the new frame using mapping
         res = torch.tensor([k[0] for k in self.motif_mapping])
         atoms = torch.tensor([k[1] for k in self.motif_mapping])
@@ -457,21 +532,19 @@ class substrate_contacts(Potential):
         substrate_atoms = (
             torch.mm(A, self.motif_substrate_atoms.transpose(0, 1)).transpose(0, 1) + t
         )
-        second_distance = torch.sqrt(
-            torch.sqrt(
-                torch.sum(torch.square(new_frame[0] - substrate_atoms[0]), dim=-1)
+        if __debug__:
+            # for checking affine transformation is corect
+            first_distance = torch.linalg.norm(
+                self.motif_substrate_atoms[0] - self.motif_frame[0]
             )
-        )
-        assert abs(first_distance - second_distance) < 0.01, "Alignment seems to be bad"
+            second_distance = torch.linalg.norm(new_frame[0] - substrate_atoms[0])
+            assert (
+                abs(first_distance - second_distance) < 0.05
+            ), "Alignment seems to be bad"
         diffusion_mask = mask_expand(self.diffusion_mask, 1)
-        Ca = xyz[~diffusion_mask, 1]
+        Ca = get_Ca(xyz, kwargs.get("cache"))[~diffusion_mask]
 
-        # cdist needs a batch dimension - NRB
-        dgram = torch.cdist(
-            Ca[None, ...].contiguous(), substrate_atoms.float()[None], p=2
-        )[
-            0
-        ]  # [Lb,Lb]
+        dgram = pairwise_dist(Ca, substrate_atoms)  # [L,Nsubstrate]
 
         all_energies = []
         for i, energy_fn in enumerate(self.energies):
@@ -484,7 +557,10 @@ class substrate_contacts(Potential):
 
     def _recover_affine(self, frame1, frame2):
         """
-        Uses Simplex Affine Matrix (SAM) formula to recover affine transform between two sets of 4 xyz coordinates
+        Recovers the affine transform between two sets of 4 xyz coordinates
+
+        Solves the 4x4 linear system [frame1 | 1] @ [A^T ; t] = frame2, which is the closed form
+        of the Simplex Affine Matrix (SAM) formula
         See: https://www.researchgate.net/publication/332410209_Beginner%27s_guide_to_mapping_simplexes_affinely
 
         Args:
@@ -497,21 +573,12 @@ class substrate_contacts(Potential):
         """
 
         l = len(frame1)
-        # construct SAM denominator matrix
-        B = torch.vstack([frame1.T, torch.ones(l)])
-        D = 1.0 / torch.linalg.det(B)  # SAM denominator
-
-        M = torch.zeros((3, 4), dtype=torch.float64)
-        for i, R in enumerate(frame2.T):
-            for j in range(l):
-                num = torch.vstack([R, B])
-                # make SAM numerator matrix
-                num = torch.cat((num[: j + 1], num[j + 2 :]))  # make numerator matrix
-                # calculate SAM entry
-                M[i][j] = (-1) ** j * D * torch.linalg.det(num)
-
-        A, t = torch.hsplit(M, [l - 1])
-        t = t.transpose(0, 1)
+        B = torch.cat([frame1, torch.ones_like(frame1[:, :1])], dim=1)  # [4,4]
+        # solve in double precision, return in the precision of the coordinates
+        M = torch.linalg.solve(B.double(), frame2.double()).to(frame2.dtype)  # [4,3]
+
+        A = M[: l - 1].transpose(0, 1)  # [3,3]
+        t = M[l - 1 :]  # [1,3]
         return A, t
 
     def _grab_motif_residues(self, xyz) -> None:
@@ -534,20 +601,23 @@ class substrate_contacts(Potential):
 
 def get_z_profile(coords, z=None, steps=40):
     if z is None:
-        z = torch.linspace(coords[:, 2].min() - 0.1, coords[:, 2].max() + 0.1, steps)
+        z = torch.linspace(
+            coords[:, 2].min() - 0.1, coords[:, 2].max() + 0.1, steps, device=coords.device
+        )
     # bucketize coords according to their z values.
     # bin_idxs can have at most z.shape[0]+1 unique numbers
     bin_idxs = torch.bucketize(coords[:, 2], boundaries=z, right=True)
-    r = (coords[:, :2] * coords[:, :2]).sum(1).sqrt()
-    rmin = torch.zeros(z.shape[0] + 1).scatter_reduce(
-        dim=0, src=r, index=bin_idxs, reduce="amin", include_self=False
-    )
-    rmean = torch.zeros(z.shape[0] + 1).scatter_reduce(
-        dim=0, src=r, index=bin_idxs, reduce="mean", include_self=False
-    )
-    rmax = torch.zeros(z.shape[0] + 1).scatter_reduce(
-        dim=0, src=r, index=bin_idxs, reduce="amax", include_self=False
-    )
+    r = coords[:, :2].pow(2).sum(1).sqrt_()
+    # sort once so that every bin is a contiguous segment shared by all three reductions
+    bin_idxs, perm = torch.sort(bin_idxs)
+    r = r[perm]
+    lengths = torch.bincount(bin_idxs, minlength=z.shape[0] + 1)
+    # empty bins are reported as 0
+    empty = lengths == 0
+    rmin, rmean, rmax = [
+        torch.segment_reduce(r, reduce, lengths=lengths).masked_fill(empty, 0)
+        for reduce in ("min", "mean", "max")
+    ]
     return torch.stack([z, rmin[:-1], rmean[:-1], rmax[:-1]], dim=1)
 
 
@@ -579,19 +649,27 @@ class z_profile(Potential):
         self.contact_matrix = contact_matrix
         self.weight = weight
         self.target_profile = self.read_profile(profile_csv)
+        # z bin boundaries, kept contiguous for torch.bucketize
+        self.target_z = self.target_profile[:, 0].contiguous()
         self.cutoff = cutoff
         self.verbose = verbose
 
     @staticmethod
     def read_profile(csv):
-        return torch.from_numpy(pd.read_csv(csv).values).float()
+        return torch.from_numpy(
+            np.loadtxt(csv, delimiter=",", skiprows=1, ndmin=2)
+        ).float()
 
     def get_z_profile(self, coords, z=None, steps=100):
         return get_z_profile(coords, z=z, steps=steps)
 
     def compute(self, xyz, **kwargs):
-        coords = xyz[:, 1].contiguous()
-        current_profile = self.get_z_profile(coords, z=self.target_profile[:, 0])
+        if self.target_profile.device != xyz.device:
+            # only moved on the first call, the sample stays on the same device
+            self.target_profile = self.target_profile.to(xyz.device)
+            self.target_z = self.target_z.to(xyz.device)
+        coords = get_Ca(xyz, kwargs.get("cache")).contiguous()
+        current_profile = self.get_z_profile(coords, z=self.target_z)
         idx = current_profile[:, 1] > 0
         deviations = (current_profile[idx, 1:] - self.target_profile[idx, 1:]) ** 2
         if self.cutoff:
@@ -605,10 +683,11 @@ class z_profile(Potential):
 def get_Rgs(coords, diagonalise=False):
     N = coords.shape[0]
     diff = coords - coords.mean(0, keepdim=True)
-    cov = torch.matmul(diff.T, diff) / N
     if diagonalise:
+        cov = torch.matmul(diff.T, diff) / N
         return torch.linalg.eigvalsh(cov).sqrt()
-    return cov.diag().sqrt()
+    # diagonal of the gyration tensor only
+    return diff.pow(2).mean(0).sqrt()
 
 
 class Rgs(Potential):
@@ -665,7 +744,7 @@ class Rgs(Potential):
         return get_Rgs(coords, self.diagonalise)
 
     def compute(self, xyz, **kwargs):
-        Rgs = self.get_Rgs(xyz[:, 1].contiguous())
+        Rgs = self.get_Rgs(get_Ca(xyz, kwargs.get("cache")).contiguous())
         pot = -sum(
             [(x - y) ** 2 for x, y in zip(Rgs, self.target_Rgs) if y is not None]
         )
@@ -683,6 +762,10 @@ def add_ideal_oxygen(xyz, non_ideal=False):
     """
     Adds an ideal backbone Oxygen if the corresponding coordinates in xyz has nan.
     """
+    # fully resolved backbones are returned as is, without copying
+    if xyz.shape[-2] >= 4 and not xyz[..., 3, :].isnan().any():
+        return xyz
+
     xyz_in = xyz.clone().float()
     if xyz.ndim == 3:
         xyz_in = xyz_in.unsqueeze(0)
@@ -697,8 +780,9 @@ def add_ideal_oxygen(xyz, non_ideal=False):
     if mask.sum() == 0:
         return xyz
 
-    log.info(mask)
-    log.info(xyz_in[0, 0, :4])
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(mask)
+        log.debug(xyz_in[0, 0, :4])
 
     Rs, Ts = rigid_from_3_points(
         xyz_in[:, mask, 0, :],
@@ -757,32 +841,48 @@ class hb_contacts(Potential):
             verbose (bool):
                 if True, informative messages are added to log.
         """
-        self.contact_matrix = contact_matrix
+        self.contact_matrix = check_contact_matrix(contact_matrix)
         self.weight_intra = weight_intra
         self.weight_inter = weight_inter
         self.verbose = verbose
         self.mode = mode
 
-        # check contact matrix only contains valid entries
-        assert all(
-            [i in [-1, 0, 1] for i in contact_matrix.flatten()]
-        ), "Contact matrix must contain only 0, 1, or -1 in entries"
-        # assert the matrix is square and symmetric
-        shape = contact_matrix.shape
-        assert len(shape) == 2
-        assert shape[0] == shape[1]
-        for i in range(shape[0]):
-            for j in range(shape[1]):
-                assert contact_matrix[i, j] == contact_matrix[j, i]
-        self.nchain = shape[0]
-
-    def _get_idx(self, i, L):
+        self.nchain = self.contact_matrix.shape[0]
+
+        # per chain residue slices, built lazily in _get_chain_slices and keyed by L
+        self._slice_cache = {}
+        # chain junction masks, built lazily in _get_junction_mask and keyed by (L, device)
+        self._junction_mask_cache = {}
+
+    def _get_chain_slices(self, L):
         """
-        Returns the zero-indexed indices of the residues in chain i
+        Returns the slices of residues belonging to each chain
         """
-        assert L % self.nchain == 0
-        Lchain = L // self.nchain
-        return i * Lchain + torch.arange(Lchain)
+        if L not in self._slice_cache:
+            assert L % self.nchain == 0
+            Lchain = L // self.nchain
+            self._slice_cache[L] = [
+                slice(i * Lchain, (i + 1) * Lchain) for i in range(self.nchain)
+            ]
+        return self._slice_cache[L]
+
+    def _get_junction_mask(self, L, device):
+        """
+        Returns a [L,L] mask that removes the hbonds pydssp only finds because the chains are
+        concatenated: the first residue of every chain but the first donates through a pseudo-H
+        placed from the previous chain's last C, and the last residue of every chain but the last
+        acts as an acceptor. Neither exists when pydssp is run on a chain on its own
+        """
+        key = (L, str(device))
+        if key not in self._junction_mask_cache:
+            chains = self._get_chain_slices(L)
+            mask = torch.ones(L, L, device=device)
+            for c in chains[1:]:
+                mask[c.start, :] = 0
+            for c in chains[:-1]:
+                mask[:, c.stop - 1] = 0
+            self._junction_mask_cache[key] = mask
+        return self._junction_mask_cache[key]
 
     def _sum(self, tensor):
         if self.mode == 0:
@@ -792,35 +892,38 @@ class hb_contacts(Potential):
 
     def compute(self, xyz, **kwargs):
         """
-        Iterate through the contact matrix, compute contact potentials between chains that need it,
-        and negate contacts for any
+        Compute the hbond map of the whole complex once, then sum the intra/inter chain
+        blocks weighted by their entries in the contact matrix
         """
         L = xyz.shape[0]
+        chains = self._get_chain_slices(L)
+
+        hb_map = get_bb_hbond_map(xyz[:, :4].contiguous())  # [L,L]
+        hb_map = hb_map * self._get_junction_mask(L, hb_map.device)
 
+        # start from a zero that stays in the autograd graph, in case every entry is zero
+        zero = hb_map.sum() * 0
         hb_intra = sum(
             [
-                self._sum(get_bb_hbond_map(xyz[self._get_idx(i, L), :4].contiguous()))
+                self._sum(hb_map[chains[i], chains[i]]) * self.contact_matrix[i, i]
                 for i in range(self.nchain)
-            ]
+                if self.contact_matrix[i, i] != 0
+            ],
+            zero,
         )
 
         hb_inter = sum(
             [
-                self._sum(
-                    get_bb_hbond_map(
-                        torch.cat(
-                            [
-                                xyz[self._get_idx(i, L), :4].contiguous(),
-                                xyz[self._get_idx(j, L), :4].contiguous(),
-                            ],
-                            dim=0,
-                        )
-                    )
+                (
+                    self._sum(hb_map[chains[i], chains[j]])
+                    + self._sum(hb_map[chains[j], chains[i]])
                 )
+                * self.contact_matrix[i, j]
                 for i in range(self.nchain)
                 for j in range(i + 1, self.nchain)
-                if i != j
-            ]
+                if self.contact_matrix[i, j] != 0
+            ],
+            zero,
         )
 
         all_hb = self.weight_intra * hb_intra + self.weight_inter * hb_inter
@@ -837,7 +940,87 @@ class hb_contacts(Potential):
 from rfdiffusion.chemical import aa2long, num2aa
 
 
-def prep_madrax_input(xyz, seq_in):
+# sequence code used by prep_madrax_input for histidines protonated on ND1
+HIS_D = len(aa2long)
+his_d_atoms = (
+    " N  ",
+    " CA ",
+    " C  ",
+    " O  ",
+    " CB ",
+    " CG ",
+    " NE2",
+    " CD2",
+    " CE1",
+    " ND1",
+    None,
+    None,
+    None,
+    None,
+    " H  ",
+    " HA ",
+    "1HB ",
+    "2HB ",
+    " HD2",
+    " HE1",
+    " HD1",
+    None,
+    None,
+    None,
+    None,
+    None,
+    None,
+)
+
+
+# atom names (stripped) and residue names of every sequence code, including HIS_D
+madrax_atoms = [
+    [None if atm is None else atm.replace(" ", "") for atm in atms]
+    for atms in aa2long + [his_d_atoms]
+]
+madrax_resnames = num2aa + [num2aa[8]]
+# madrax_atom_mask[s,j] is True if atom j of sequence code s exists
+madrax_atom_mask = torch.tensor(
+    [[atm is not None for atm in atms] for atms in madrax_atoms], dtype=torch.bool
+)
+
+
+def _madrax_atom_index(seq, natoms):
+    """
+    Flat (residue*natoms + atom) index of every atom MadraX sees in a chain
+
+    Args:
+        seq (tuple): residue codes, with HIS_D in place of histidines protonated on ND1
+    """
+    valid = madrax_atom_mask[torch.tensor(seq, dtype=torch.long), :natoms]
+    res_idx, atom_idx = valid.nonzero(as_tuple=True)
+    return res_idx * natoms + atom_idx
+
+
+def _format_madrax_atnames(key, chain="A"):
+    """
+    MadraX atom names of a chain, in the order of _madrax_atom_index
+
+    Args:
+        key (tuple): (seq, natoms, first_resnum) as returned by _index_madrax_chain
+    """
+    seq, natoms, first_resnum = key
+    flat_idx = _madrax_atom_index(seq, natoms).tolist()
+    return [
+        f"{madrax_resnames[seq[k // natoms]]}_{first_resnum + k // natoms}_"
+        f"{madrax_atoms[seq[k // natoms]][k % natoms]}_{chain}_0_0"
+        for k in flat_idx
+    ]
+
+
+def _index_madrax_chain(xyz, seq_in, first_resnum=1, cache=None):
+    """
+    Finds the atoms of a chain MadraX sees, without naming them
+
+    Returns:
+        key (tuple): (seq, natoms, first_resnum), identifies the atoms, see _format_madrax_atnames
+        flat_idx (torch.tensor): index of the atoms in xyz.reshape(-1,3)
+    """
     # take glycines, except for motif region
     if seq_in.ndim>1:
         seq = torch.where(
@@ -846,74 +1029,185 @@ def prep_madrax_input(xyz, seq_in):
     else:
         seq = torch.where(seq_in == 21, 7, seq_in)  # 7 is glycine
 
-    idx_pdb = 1 + torch.arange(xyz.shape[0])
-    chain = "A"
     natoms = xyz.shape[1]
     assert natoms == 14 or natoms == 27
-    coords = []
-    atnames = []
-    ctr = 1
-    for i, s in enumerate(seq.squeeze()):
-        atms = aa2long[s]
-        # his prot hack
-        if s == 8 and torch.linalg.norm(xyz[i, 9, :] - xyz[i, 5, :]) < 1.7:
-            atms = (
-                " N  ",
-                " CA ",
-                " C  ",
-                " O  ",
-                " CB ",
-                " CG ",
-                " NE2",
-                " CD2",
-                " CE1",
-                " ND1",
-                None,
-                None,
-                None,
-                None,
-                " H  ",
-                " HA ",
-                "1HB ",
-                "2HB ",
-                " HD2",
-                " HE1",
-                " HD1",
-                None,
-                None,
-                None,
-                None,
-                None,
-                None,
-            )  # his_d
-        for j, atm_j in enumerate(atms):
-            if j < natoms and atm_j is not None:
-                atnames.append(f"{num2aa[s]}_{ctr}_{atm_j.replace(' ','')}_{chain}_0_0")
-                coords.append(xyz[i, j, :])
-        ctr += 1
-    atnames = [atnames]
-    coords = torch.stack(coords).unsqueeze(0)
+    # his prot hack
+    his_d = (seq == 8) & (torch.linalg.norm(xyz[:, 9] - xyz[:, 5], dim=-1) < 1.7)
+    seq = tuple(torch.where(his_d, HIS_D, seq).tolist())
+    key = (seq, natoms, first_resnum)
+
+    idx_key = ("index", seq, natoms, str(xyz.device))
+    flat_idx = None if cache is None else cache.get(idx_key)
+    if flat_idx is None:
+        flat_idx = _madrax_atom_index(seq, natoms).to(xyz.device)
+        if cache is not None:
+            cache[idx_key] = flat_idx
+    return key, flat_idx
+
+
+def _get_madrax_atnames(key, cache=None):
+    """
+    Formats the atom names of a chain key, or takes them from cache
+    """
+    if cache is None:
+        return _format_madrax_atnames(key)
+    names_key = ("names",) + key
+    if names_key not in cache:
+        cache[names_key] = _format_madrax_atnames(key)
+    return cache[names_key]
+
+
+def prep_madrax_input(xyz, seq_in, first_resnum=1, atnames_cache=None):
+    """
+    Gathers the atoms of a chain and names them for MadraX
+
+    Args:
+        atnames_cache (dict, optional): if given, the atom names and indices are stored in it keyed by
+            sequence, so they are only built once per design
+
+    Returns:
+        coords (torch.tensor, size: [1,Natoms,3]): coordinates of the named atoms
+        atnames (list): a single list of atom names
+    """
+    key, flat_idx = _index_madrax_chain(xyz, seq_in, first_resnum, cache=atnames_cache)
+    # gather all atoms in a single kernel
+    coords = xyz.reshape(-1, 3).index_select(0, flat_idx).unsqueeze(0)
+    return coords, [_get_madrax_atnames(key, cache=atnames_cache)]
+
+
+def stack_madrax_inputs(inputs):
+    """
+    Stacks prepared MadraX inputs so they can be evaluated by a single MadraX forward pass
+
+    Args:
+        inputs (list): list of (coords, atnames) tuples as returned by prep_madrax_input,
+            atnames may be replaced by any single per-system label
+
+    Returns:
+        coords (torch.tensor, size: [B,Natoms,3]): coordinates, zero padded to the largest system
+        atnames (list): B lists of atom names (or labels), one per system
+    """
+    if len(inputs) == 1:
+        # a single system is already in batch layout, no need to copy it into a padded buffer
+        return inputs[0]
+    coords = torch.nn.utils.rnn.pad_sequence(
+        [coords_i[0] for coords_i, _ in inputs], batch_first=True
+    )
+    atnames = [atnames_i[0] for _, atnames_i in inputs]
     return coords, atnames
 
 
-def get_madrax_energy(xyz, seq_in, FF=None, device="cpu", clip=None):
+# MadraX ForceField instances shared between potentials, keyed by device
+_FF_CACHE = {}
+
+
+def _get_ff(device):
+    """
+    Returns the shared MadraX ForceField on device, constructing it on first use
+    """
+    key = str(device)
+    if key not in _FF_CACHE:
+        from madrax.ForceField import ForceField  # the main MadraX module
+
+        _FF_CACHE[key] = ForceField(device=device)
+    return _FF_CACHE[key]
+
+
+def _is_on_device(module, device):
+    """
+    Returns True if the parameters of module already live on device
+    """
+    param = next(module.parameters(), None)
+    if param is None:
+        return False
+    device = torch.device(device)
+    if device.type == "cuda" and device.index is None:
+        # a bare "cuda" means the current device, which is where .to("cuda") sends tensors
+        device = torch.device("cuda", torch.cuda.current_device())
+    return param.device == device
+
+
+def get_madrax_batch_energy(
+    coords,
+    atnames,
+    FF=None,
+    device="cpu",
+    clip=None,
+    amp=False,
+    info_cache=None,
+    info_key=None,
+):
+    """
+    MadraX energies of a batch of prepared systems (see stack_madrax_inputs), using a single ForceField call.
+    If amp is True and the device is a GPU, the ForceField is evaluated under bf16 autocast with TF32
+    matmuls allowed, both only for the duration of the call.
+    If info_cache (dict) is given, the MadraX info tensors are stored in it keyed by info_key, or by the
+    atom names if no info_key is given. atnames may be a callable returning the atom names, so they are
+    only formatted when the info tensors are not cached
+
+    Returns:
+        E (torch.tensor): MadraX energies with the systems along the first dimension
+    """
     from madrax import dataStructures
 
     if device is None:
-        device = xyz.device
+        device = coords.device
     if FF is None:
-        from madrax.ForceField import ForceField  # the main MadraX module
-        FF = ForceField(device=device)
-    else:
+        FF = _get_ff(device)
+    elif not _is_on_device(FF, device):
         FF.to(device)
-    coords, atnames = prep_madrax_input(xyz, seq_in)
-    info_tensors = dataStructures.create_info_tensors(atnames, device=device)
-    E = FF(coords.to(device), info_tensors)
+    if info_cache is None:
+        if callable(atnames):
+            atnames = atnames()
+        info_tensors = dataStructures.create_info_tensors(atnames, device=device)
+    else:
+        # atom names only depend on the sequence and chain layout, so they repeat across diffusion steps
+        if info_key is None:
+            if callable(atnames):
+                atnames = atnames()
+            info_key = tuple(tuple(atnames_i) for atnames_i in atnames)
+        key = (str(device), info_key)
+        info_tensors = info_cache.get(key)
+        if info_tensors is None:
+            if callable(atnames):
+                atnames = atnames()
+            info_tensors = dataStructures.create_info_tensors(atnames, device=device)
+            info_cache[key] = info_tensors
+    device_type = torch.device(device).type
+    use_amp = amp and device_type == "cuda"
+    # TF32 is a process wide switch, so only flip it around the MadraX forward pass
+    allow_tf32 = torch.backends.cuda.matmul.allow_tf32
+    try:
+        if use_amp:
+            torch.backends.cuda.matmul.allow_tf32 = True
+        with torch.autocast(
+            device_type=device_type, dtype=torch.bfloat16, enabled=use_amp
+        ):
+            E = FF(coords.to(device), info_tensors)
+    finally:
+        torch.backends.cuda.matmul.allow_tf32 = allow_tf32
+    # back to fp32 for clipping and the reductions downstream
+    E = E.float()
     if clip:
-        E.clamp_(min=-clip, max=clip)
+        E = E.clamp(min=-clip, max=clip)
     return E
 
 
+def get_madrax_energy(
+    xyz, seq_in, FF=None, device="cpu", clip=None, amp=False, info_cache=None
+):
+    coords, atnames = prep_madrax_input(xyz, seq_in)
+    return get_madrax_batch_energy(
+        coords,
+        atnames,
+        FF=FF,
+        device=device,
+        clip=clip,
+        amp=amp,
+        info_cache=info_cache,
+    )
+
+
 class madrax_energy(Potential):
     """
     Applies a potential to minimise the madrax energy
@@ -928,6 +1222,8 @@ class madrax_energy(Potential):
         clip=None,
         verbose=True,
         device="cuda",
+        amp=False,
+        compile_ff=False,
     ):
         """
         Parameters:
@@ -944,118 +1240,184 @@ class madrax_energy(Potential):
 
             verbose (bool):
                 if True, informative messages are added to log.
-        """
-        from madrax.ForceField import ForceField
 
-        self.contact_matrix = contact_matrix
+            amp (bool, optional):
+                if True, evaluate MadraX in bf16 autocast and allow TF32 matmuls on GPU,
+                only for the MadraX forward pass
+
+            compile_ff (bool, optional):
+                if True, evaluate MadraX through torch.compile (requires torch>=2.0)
+        """
+        self.contact_matrix = check_contact_matrix(contact_matrix)
         self.weight_intra = weight_intra
         self.weight_inter = weight_inter
         self.clip = clip
         self.device = device
         self.verbose = verbose
-        self.FF = ForceField(self.device)
-
-        # check contact matrix only contains valid entries
-        assert all(
-            [i in [-1, 0, 1] for i in contact_matrix.flatten()]
-        ), "Contact matrix must contain only 0, 1, or -1 in entries"
-        # assert the matrix is square and symmetric
-        shape = contact_matrix.shape
-        assert len(shape) == 2
-        assert shape[0] == shape[1]
-        for i in range(shape[0]):
-            for j in range(shape[1]):
-                assert contact_matrix[i, j] == contact_matrix[j, i]
-        self.nchain = shape[0]
-
-    def _get_idx(self, i, L):
-        """
-        Returns the zero-indexed indices of the residues in chain i
-        """
-        assert L % self.nchain == 0
-        Lchain = L // self.nchain
-        return i * Lchain + torch.arange(Lchain)
+        self.amp = amp
+        self.FF = _get_ff(self.device)
+        self._ff_compiled = None
+        if compile_ff:
+            if hasattr(torch, "compile"):
+                # the batch size and atom count are fixed for a design, so CUDA graphs get replayed
+                self._ff_compiled = torch.compile(self.FF, mode="reduce-overhead")
+            else:
+                log.warning(
+                    "'madrax_energy': torch.compile is not available, running MadraX eagerly"
+                )
+        # MadraX info tensors, keyed by the atom names of the batch
+        self._info_cache = {}
+        # MadraX atom indices and names, keyed by chain sequence
+        self._atnames_cache = {}
+        self.nchain = self.contact_matrix.shape[0]
+
+        # chains and chain pairs with a non-zero contact weight, the only ones MadraX is run on
+        cm = self.contact_matrix.tolist()
+        self._intra_chains = [i for i in range(self.nchain) if cm[i][i] != 0]
+        self._pairs = [
+            (i, j)
+            for i in range(self.nchain)
+            for j in range(i + 1, self.nchain)
+            if cm[i][j] != 0
+        ]
+        # attractive (1) or repulsive (-1) sign of every evaluated system, in batch order
+        self._signs = torch.tensor(
+            [cm[i][i] for i in self._intra_chains]
+            + [cm[i][j] for i, j in self._pairs]
+        )
+        # contribution of every evaluated system to the potential, so it reduces to a single dot product
+        self._weights = -self._signs * torch.tensor(
+            [float(weight_intra)] * len(self._intra_chains)
+            + [float(weight_inter)] * len(self._pairs)
+        )
 
     def compute(self, xyz, **kwargs):
         """
-        Iterate through the contact matrix, compute contact potentials between chains that need it,
-        and negate contacts for any
+        Computes the MadraX energy of every chain and chain pair with a non-zero contact matrix entry,
+        weighted by the sign of the entry. All of them are padded into one batch and evaluated
+        concurrently by a single ForceField forward pass
         """
         L = xyz.shape[0]
         seq_in = kwargs["seq_in"]
-        e_intra = sum(
-            [
-                get_madrax_energy(
-                    xyz[self._get_idx(i, L)].contiguous(),
-                    seq_in[self._get_idx(i, L)].contiguous(),
-                    FF=self.FF,
-                    clip=self.clip,
-                    device=self.device,
-                ).sum()
-                for i in range(self.nchain)
-            ]
-        )
-        e_inter = sum(
-            [
-                get_madrax_energy(
-                    torch.cat(
-                        [
-                            xyz[self._get_idx(i, L)].contiguous(),
-                            xyz[self._get_idx(j, L)].contiguous(),
-                        ],
-                        dim=0,
-                    ),
-                    torch.cat(
-                        [
-                            seq_in[self._get_idx(i, L)].contiguous(),
-                            seq_in[self._get_idx(j, L)].contiguous(),
-                        ],
-                        dim=0,
-                    ),
-                    FF=self.FF,
-                    clip=self.clip,
-                    device=self.device,
-                ).sum()
-                for i in range(self.nchain)
-                for j in range(i + 1, self.nchain)
-                if i != j
+
+        assert L % self.nchain == 0
+        Lchain = L // self.nchain
+        # zero copy views of each chain
+        xyz_chains = [xyz.narrow(0, i * Lchain, Lchain) for i in range(self.nchain)]
+        seq_chains = [seq_in.narrow(0, i * Lchain, Lchain) for i in range(self.nchain)]
+
+        # prepare every chain that is needed once, numbered both as the first and as the second chain of a pair
+        first = set(self._intra_chains) | {i for i, _ in self._pairs}
+        # atom names are only formatted when the info tensors of the batch are not cached yet
+        as_first = {
+            i: _index_madrax_chain(xyz_chains[i], seq_chains[i], cache=self._atnames_cache)
+            for i in first
+        }
+        as_second = {
+            j: _index_madrax_chain(
+                xyz_chains[j],
+                seq_chains[j],
+                first_resnum=Lchain + 1,
+                cache=self._atnames_cache,
+            )
+            for j in {j for _, j in self._pairs}
+        }
+
+        # chains on their own, followed by pairs of chains, labelled by the keys of their chains.
+        # The atoms of each system are gathered from the whole complex with a single index
+        flat_xyz = xyz.reshape(-1, 3)
+        chain_stride = Lchain * xyz.shape[1]
+        inputs = []
+        for system in [(i,) for i in self._intra_chains] + self._pairs:
+            chains = [as_first[system[0]]] + [as_second[j] for j in system[1:]]
+            keys = tuple(key for key, _ in chains)
+            idx_key = ("system", system, keys, str(xyz.device))
+            idx = self._atnames_cache.get(idx_key)
+            if idx is None:
+                idx = torch.cat(
+                    [
+                        flat_idx + i * chain_stride
+                        for i, (_, flat_idx) in zip(system, chains)
+                    ]
+                )
+                self._atnames_cache[idx_key] = idx
+            inputs.append((flat_xyz.index_select(0, idx).unsqueeze(0), [keys]))
+        if not inputs:
+            # zero that stays in the autograd graph, so backward works if this is the only potential
+            return get_Ca(xyz, kwargs.get("cache")).sum() * 0
+        coords, keys = stack_madrax_inputs(inputs)
+
+        def atnames():
+            return [
+                [
+                    name
+                    for key in keys_i
+                    for name in _get_madrax_atnames(key, cache=self._atnames_cache)
+                ]
+                for keys_i in keys
             ]
-        )
 
-        all_e = -(self.weight_intra * e_intra + self.weight_inter * e_inter)
-        if self.verbose:
+        E = get_madrax_batch_energy(
+            coords,
+            atnames,
+            FF=self._ff_compiled or self.FF,
+            device=self.device,
+            amp=self.amp,
+            info_cache=self._info_cache,
+            info_key=tuple(keys),
+        )
+        E = E.reshape(E.shape[0], -1)
+        if self.clip:
+            E = E.clamp(min=-self.clip, max=self.clip)
+        E = E.sum(dim=-1)  # [nsystems]
+        if self._weights.device != E.device:
+            self._signs = self._signs.to(E.device)
+            self._weights = self._weights.to(E.device)
+
+        all_e = E @ self._weights
+        if self.verbose and log.isEnabledFor(logging.INFO):
+            E = E.detach() * self._signs
+            nintra = len(self._intra_chains)
+            # a single device to host copy for all logged values
+            e_intra, e_inter, e_all = torch.stack(
+                [E[:nintra].sum(), E[nintra:].sum(), all_e.detach()]
+            ).tolist()
             log.info(
                 f"'madrax_energy' guiding potential: clip_value={self.clip}, "
                 f"intra_energy={e_intra:.3g}, "
                 f"inter_energy={e_inter:.3g}, "
-                f"potential={all_e:.3g}"
+                f"potential={e_all:.3g}"
             )
         return all_e
 
 
 # Dictionary of types of potentials indexed by name of potential. Used by PotentialManager.
 # If you implement a new potential you must add it to this dictionary for it to be used by
-# the PotentialManager
-implemented_potentials = {
-    "monomer_ROG": monomer_ROG,
-    "binder_ROG": binder_ROG,
-    "dimer_ROG": dimer_ROG,
-    "binder_ncontacts": binder_ncontacts,
-    "interface_ncontacts": interface_ncontacts,
-    "monomer_contacts": monomer_contacts,
-    "olig_contacts": olig_contacts,
-    "substrate_contacts": substrate_contacts,
-    "z_profile": z_profile,
-    "Rgs": Rgs,
-    "hb_contacts": hb_contacts,
-    "madrax_energy": madrax_energy,
-}
-
-require_binderlen = {
-    "binder_ROG",
-    "binder_distance_ReLU",
-    "binder_any_ReLU",
-    "dimer_ROG",
-    "binder_ncontacts",
-    "interface_ncontacts",
-}
+# the PotentialManager. The registry is read-only at runtime
+implemented_potentials = MappingProxyType(
+    {
+        "monomer_ROG": monomer_ROG,
+        "binder_ROG": binder_ROG,
+        "dimer_ROG": dimer_ROG,
+        "binder_ncontacts": binder_ncontacts,
+        "interface_ncontacts": interface_ncontacts,
+        "monomer_contacts": monomer_contacts,
+        "olig_contacts": olig_contacts,
+        "substrate_contacts": substrate_contacts,
+        "z_profile": z_profile,
+        "Rgs": Rgs,
+        "hb_contacts": hb_contacts,
+        "madrax_energy": madrax_energy,
+    }
+)
+
+require_binderlen = frozenset(
+    {
+        "binder_ROG",
+        "binder_distance_ReLU",
+        "binder_any_ReLU",
+        "dimer_ROG",
+        "binder_ncontacts",
+        "interface_ncontacts",
+    }
+)